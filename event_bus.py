@@ -1,7 +1,15 @@
 import abc
+import contextlib
+import gzip
 import json
+import os
+import random
+import re
+import shutil
+import tempfile
 import types
 import unittest
+from collections import deque
 
 
 class EventSource:
@@ -41,6 +49,90 @@ class EventHandler(object):
         """
         raise NotImplementedError
 
+    def close(self):
+        """Releases any resources held by the handler.
+        """
+        pass
+
+
+_PRIMITIVE_TYPES = (str, unicode, int, long, float, bool, types.NoneType)
+
+# Global encoder registry, keyed by class.
+_encoders = {}
+
+
+def register_encoder(cls, encoder):
+    """Registers a fast-path encoder for instances of the supplied class.
+
+    The encoder output is written as-is, so it must already consist solely of
+    JSON-serializable values. Encoders take effect for event encoders created
+    before registration too, provided no instance of the class was encoded
+    yet.
+
+    :param cls: The class to register the encoder for.
+    :type cls: class
+
+    :param encoder: A unary function mapping an instance of `cls` to its
+                    JSON representation.
+    :type encoder: function (cls) => mixed
+    """
+
+    _encoders[cls] = encoder
+
+
+class EventEncoder:
+    """Converts event payloads to JSON-serializable values.
+
+    An encoding function is compiled once per class and cached, so repeated
+    payload types (tasks, offers, resource vectors) avoid re-discovering how
+    to represent themselves on every event.
+    """
+
+    def __init__(self):
+        self.encoders = {}
+
+    def encode(self, value):
+        """Returns a JSON-serializable representation of the supplied value.
+
+        :param value: Value to encode.
+        :type value: mixed
+        """
+
+        cls = value.__class__
+        encoder = self.encoders.get(cls)
+        if encoder is None:
+            encoder = self._compile(cls)
+            self.encoders[cls] = encoder
+        return encoder(value)
+
+    def _compile(self, cls):
+        encode = self.encode
+
+        registered = _encoders.get(cls)
+        if registered is not None:
+            return registered
+
+        if cls in _PRIMITIVE_TYPES:
+            return lambda value: value
+
+        if issubclass(cls, (list, tuple)):
+            return lambda value: [encode(x) for x in value]
+
+        if issubclass(cls, dict):
+            return lambda value: dict((k, encode(v))
+                                      for k, v in value.iteritems())
+
+        # Honour the optional representational override.
+        if hasattr(cls, "represent"):
+            return lambda value: encode(value.represent())
+
+        # Reference other event sources by id rather than embedding them.
+        if issubclass(cls, EventSource):
+            return lambda value: value.source_id()
+
+        # Fall back to object dictionary
+        return lambda value: encode(value.__dict__)
+
 
 class JsonFileEventWriter(EventHandler):
     """Event handler that emits event data as JSON to a file.
@@ -53,35 +145,308 @@ class JsonFileEventWriter(EventHandler):
         """
 
         self.out_file = open(out_file_path, "w+")
+        self.encoder = EventEncoder()
+
+    def handle(self, event):
+        representation = self.encoder.encode(event)
+        json.dump(representation, self.out_file)
+        self.out_file.write("\n")
+
+    def close(self):
+        self.out_file.close()
+
+
+class RotatingEventWriter(EventHandler):
+    """Event handler that streams JSON events into a series of optionally
+    gzip-compressed segment files, starting a new segment once the current
+    one exceeds a size or spans a simulation time limit.
+
+    Segments are named `<prefix>.<index>` (plus `.gz` when compressed) and
+    can be read back in order with `read_events`. Segments left under the
+    same prefix by an earlier run are deleted when the writer is created.
+    """
+
+    def __init__(self, out_file_prefix, max_bytes=None, max_time=None,
+                 compress=True):
+        """
+        :param out_file_prefix: Path prefix of the segment files.
+        :type out_file_prefix: str
+
+        :param max_bytes: Uncompressed size after which a new segment is
+                          started, or None for no size limit.
+        :type max_bytes: int
 
-    def _is_class(self, value):
-        return isinstance(value, types.InstanceType)
+        :param max_time: Number of simulation time-steps covered by each
+                         segment, or None for no time limit.
+        :type max_time: int
 
-    def _represent(self, value):
-        if isinstance(value, list):
-            transform = lambda x: self._represent(x)
-            return map(transform, value)
+        :param compress: Whether segments are gzip-compressed.
+        :type compress: bool
+        """
+
+        self.out_file_prefix = out_file_prefix
+        self.max_bytes = max_bytes
+        self.max_time = max_time
+        self.compress = compress
+        self.encoder = EventEncoder()
+
+        for segment_path in _segment_paths(out_file_prefix):
+            os.remove(segment_path)
+
+        self.segment = -1
+        self.out_file = None
+        self.segment_bytes = 0
+        self.segment_start_time = None
+
+    def _segment_path(self, segment):
+        path = "%s.%05d" % (self.out_file_prefix, segment)
+        if self.compress:
+            path += ".gz"
+        return path
+
+    def _rotate(self, time):
+        self.close()
+        self.segment += 1
+        path = self._segment_path(self.segment)
+        if self.compress:
+            self.out_file = gzip.open(path, "wb")
+        else:
+            self.out_file = open(path, "w")
+        self.segment_bytes = 0
+        self.segment_start_time = time
+
+    def handle(self, event):
+        time = event.get("time")
+        if self.out_file is None or \
+                (self.max_time is not None and time is not None and
+                 time - self.segment_start_time >= self.max_time):
+            self._rotate(time)
+
+        line = json.dumps(self.encoder.encode(event)) + "\n"
+        self.out_file.write(line)
+        self.segment_bytes += len(line)
+
+        if self.max_bytes is not None and self.segment_bytes >= self.max_bytes:
+            # Start the next segment lazily, on the next event.
+            self.close()
+
+    def close(self):
+        if self.out_file is not None:
+            self.out_file.close()
+            self.out_file = None
+
+
+_SEGMENT_PATTERN = re.compile(r"\.(\d+)(\.gz)?$")
+
+
+def _open_event_file(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path)
+
+
+def _segment_paths(prefix_path):
+    """Returns the paths of the segments with the supplied prefix, in index
+    order.
+    """
+
+    directory, prefix = os.path.split(prefix_path)
+    if not os.path.isdir(directory or "."):
+        return []
+
+    segments = []
+    for name in os.listdir(directory or "."):
+        if not name.startswith(prefix):
+            continue
+        match = _SEGMENT_PATTERN.match(name[len(prefix):])
+        if match is not None:
+            segments.append((int(match.group(1)), name))
+    return [os.path.join(directory, name) for _, name in sorted(segments)]
+
+
+def read_events(path):
+    """Iterates over the events written by a `JsonFileEventWriter` to `path`
+    or by a `RotatingEventWriter` with prefix `path`, across all segments
+    in order.
+
+    The final segment may be truncated if the writing run crashed or was
+    killed; iteration then stops at the last complete event with a warning.
+
+    :param path: Event file path or segment prefix.
+    :type path: str
+
+    :rtype: iterator of dict
+    """
+
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = _segment_paths(path)
+
+    for index, event_path in enumerate(paths):
+        with contextlib.closing(_open_event_file(event_path)) as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (IOError, EOFError, ValueError):
+                if index != len(paths) - 1:
+                    raise
+                print("WARNING: Event log %s is truncated, stopping at its "
+                      "last complete event" % event_path)
+                return
+
+
+def _dump_events(events, out_file_path):
+    writer = JsonFileEventWriter(out_file_path)
+    try:
+        for event in events:
+            writer.handle(event)
+    finally:
+        writer.close()
+
+
+class RingBufferEventHandler(EventHandler):
+    """Event handler that keeps the most recent events in memory.
+
+    Events are stored in encoded form, so the buffer does not keep payload
+    objects (such as agents referenced by offers) alive. Memory use is
+    bounded by the capacity, so the handler can stay attached for
+    arbitrarily long runs and be dumped on demand or when a run fails.
+    """
+
+    def __init__(self, capacity):
+        """
+        :param capacity: Maximum number of events to retain.
+        :type capacity: int
+        """
 
-        if isinstance(value, dict):
-            transform = lambda (k,v): (k, self._represent(v))
-            result = dict(map(transform, value.iteritems()))
-            return result
+        self.buffer = deque(maxlen=capacity)
+        self.encoder = EventEncoder()
+
+    def handle(self, event):
+        self.buffer.append(self.encoder.encode(event))
+
+    def events(self):
+        """Returns the retained events, oldest first.
+
+        :rtype: list of dict
+        """
 
-        if not self._is_class(value):
-            return value
+        return list(self.buffer)
+
+    def dump(self, out_file_path):
+        """Writes the retained events as JSON to a file.
+
+        :param out_file_path: Path to the event output file.
+        :type out_file_path: str
+        """
+
+        _dump_events(self.buffer, out_file_path)
+
+    @contextlib.contextmanager
+    def dump_on_error(self, out_file_path):
+        """Context manager that dumps the retained events if the body raises.
+
+        :param out_file_path: Path to the event output file.
+        :type out_file_path: str
+        """
 
-        # Attempt to invoke an optional representational override.
         try:
-            return value.represent()
+            yield self
+        except BaseException:
+            self.dump(out_file_path)
+            raise
 
-        # Fall back to object dictionary
-        except:
-            return self._represent(value.__dict__)
+
+class SamplingEventHandler(EventHandler):
+    """Event handler that forwards every k-th event of each name to another
+    handler.
+    """
+
+    def __init__(self, delegate, rates=None, default_rate=1):
+        """
+        :param delegate: Handler receiving the sampled events.
+        :type delegate: EventHandler
+
+        :param rates: Sampling interval per event name. For example,
+                      {"resource_offer": 100} forwards one in every hundred
+                      offers.
+        :type rates: dict of str => int
+
+        :param default_rate: Sampling interval for event names without a
+                             configured rate.
+        :type default_rate: int
+        """
+
+        self.delegate = delegate
+        self.rates = rates or {}
+        self.default_rate = default_rate
+        self.counts = {}
 
     def handle(self, event):
-        representation = self._represent(event)
-        json.dump(representation, self.out_file)
-        self.out_file.write("\n")
+        name = event["name"]
+        count = self.counts.get(name, 0)
+        self.counts[name] = count + 1
+        if count % self.rates.get(name, self.default_rate) == 0:
+            self.delegate.handle(event)
+
+    def close(self):
+        self.delegate.close()
+
+
+class ReservoirEventHandler(EventHandler):
+    """Event handler that keeps a uniform random sample of fixed size of the
+    events of each name, stored in encoded form.
+    """
+
+    def __init__(self, size, seed=None):
+        """
+        :param size: Number of events to retain per event name.
+        :type size: int
+
+        :param seed: Optional seed for the sampling random number generator.
+        :type seed: hashable
+        """
+
+        self.size = size
+        self.random = random.Random(seed)
+        self.reservoirs = {}
+        self.counts = {}
+        self.encoder = EventEncoder()
+
+    def handle(self, event):
+        name = event["name"]
+        reservoir = self.reservoirs.setdefault(name, [])
+        count = self.counts.get(name, 0) + 1
+        self.counts[name] = count
+
+        if len(reservoir) < self.size:
+            reservoir.append(self.encoder.encode(event))
+            return
+
+        index = self.random.randint(0, count - 1)
+        if index < self.size:
+            reservoir[index] = self.encoder.encode(event)
+
+    def events(self):
+        """Returns the sampled events of all names, ordered by time.
+
+        :rtype: list of dict
+        """
+
+        result = []
+        for reservoir in self.reservoirs.itervalues():
+            result.extend(reservoir)
+        return sorted(result, key=lambda event: event["time"])
+
+    def dump(self, out_file_path):
+        """Writes the sampled events as JSON to a file.
+
+        :param out_file_path: Path to the event output file.
+        :type out_file_path: str
+        """
+
+        _dump_events(self.events(), out_file_path)
 
 
 class EventBus:
@@ -100,6 +465,9 @@ class EventBus:
         self.handlers = handlers
         self.current_time = current_time
 
+        # Number of events published so far, for throughput reporting.
+        self.published = 0
+
     def publish(self, source, event_name, data=None):
         """Forwards an event to all of the configured event handlers.
 
@@ -124,6 +492,7 @@ class EventBus:
         event["source"] = source.source_name()
         event["id"] = source.source_id()
         event["time"] = self.current_time()
+        self.published += 1
 
         for h in self.handlers:
             h.handle(event)
@@ -132,29 +501,85 @@ class EventBus:
 def _get_event_handlers(config):
     """Returns a list of the configured event handler instances.
 
+    The following configuration options are recognized:
+
+    - "event_log": Path of the JSON event file, or None for no event file.
+      Defaults to "events.txt".
+    - "event_log_rotate": Keyword arguments of a `RotatingEventWriter`
+      (max_bytes, max_time, compress). When present, "event_log" is used as
+      the segment prefix instead of a single file.
+    - "event_sample_rates": Sampling interval per event name for the event
+      file, see `SamplingEventHandler`.
+    - "event_sample_default_rate": Sampling interval for other event names.
+    - "event_ring_buffer": Capacity of an in-memory `RingBufferEventHandler`.
+    - "event_reservoir": Per-name size of a `ReservoirEventHandler`.
+
     :param config: A global program configuration object.
     :type config: dict
 
     :rtype: list of EventHandler
     """
 
-    # TODO(CD): Base the result value on configuration options.
-    return [JsonFileEventWriter("events.txt")]
+    handlers = []
+
+    event_log = config.get("event_log", "events.txt")
+    if event_log is not None:
+        rotate = config.get("event_log_rotate")
+        if rotate is not None:
+            writer = RotatingEventWriter(event_log, **rotate)
+        else:
+            writer = JsonFileEventWriter(event_log)
+
+        sample_rates = config.get("event_sample_rates")
+        default_rate = config.get("event_sample_default_rate", 1)
+        if sample_rates is not None or default_rate != 1:
+            writer = SamplingEventHandler(writer, sample_rates, default_rate)
+        handlers.append(writer)
+
+    ring_buffer = config.get("event_ring_buffer")
+    if ring_buffer is not None:
+        handlers.append(RingBufferEventHandler(ring_buffer))
+
+    reservoir = config.get("event_reservoir")
+    if reservoir is not None:
+        handlers.append(ReservoirEventHandler(reservoir))
+
+    return handlers
 
 
 # Static singleton event bus instance
 _event_bus = None
 
 
-def initialize_event_bus(current_time):
+def initialize_event_bus(current_time, config=None):
     """Creates a global event bus instance. It is an error to invoke this
     function more than once.
+
+    :param config: Event handler configuration, see `_get_event_handlers`.
+    :type config: dict
     """
 
     global _event_bus
     if _event_bus is not None:
         raise Exception("Event bus must be initialized only once.")
-    _event_bus = EventBus(_get_event_handlers({}), current_time)
+    _event_bus = EventBus(_get_event_handlers(config or {}), current_time)
+
+
+def configure_event_bus(config):
+    """Closes the event handlers of the global event bus and replaces them
+    with handlers created from the supplied configuration.
+
+    :param config: Event handler configuration, see `_get_event_handlers`.
+    :type config: dict
+
+    :rtype: list of EventHandler
+    """
+
+    event_bus = get_event_bus()
+    for handler in event_bus.handlers:
+        handler.close()
+    event_bus.handlers = _get_event_handlers(config)
+    return event_bus.handlers
 
 
 def get_event_bus():
@@ -253,5 +678,239 @@ class TestEventBus(unittest.TestCase):
         self.assertTrue(handler.events[0] == expected0)
 
 
+class TestEventEncoder(unittest.TestCase):
+
+    def test_encode(self):
+        class Vector:
+            def __init__(self, vector):
+                self.vector = vector
+
+        class Source(EventSource):
+            def source_name(self):
+                return "agent"
+
+            def source_id(self):
+                return "agent_0"
+
+        class Payload:
+            def __init__(self):
+                self.source = Source()
+                self.resources = Vector([1, 2])
+
+        encoder = EventEncoder()
+        encoder.encoders[Vector] = lambda v: v.vector
+        expected = {"source": "agent_0", "resources": [1, 2]}
+        self.assertEqual(encoder.encode([Payload()]), [expected])
+        self.assertTrue(Payload in encoder.encoders)
+
+    def test_register_after_creation(self):
+        class Vector:
+            def __init__(self, vector):
+                self.vector = vector
+
+            def represent(self):
+                return {"slow": self.vector}
+
+        encoder = EventEncoder()
+        register_encoder(Vector, lambda v: v.vector)
+        try:
+            self.assertEqual(encoder.encode(Vector([1, 2])), [1, 2])
+        finally:
+            del _encoders[Vector]
+
+    def test_write(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            writer = JsonFileEventWriter(path)
+            writer.handle({"name": "test_event", "data": (1, "a")})
+            writer.out_file.close()
+            with open(path) as f:
+                event = json.loads(f.readline())
+            self.assertEqual(event, {"name": "test_event", "data": [1, "a"]})
+        finally:
+            os.remove(path)
+
+
+class TestSamplingHandlers(unittest.TestCase):
+
+    class Collector(EventHandler):
+        def __init__(self):
+            self.events = []
+
+        def handle(self, event):
+            self.events.append(event)
+
+    def events(self, name, count):
+        return [{"name": name, "time": t} for t in range(count)]
+
+    def test_ring_buffer(self):
+        handler = RingBufferEventHandler(3)
+        for event in self.events("offer", 5):
+            handler.handle(event)
+        times = [event["time"] for event in handler.events()]
+        self.assertEqual(times, [2, 3, 4])
+
+    def test_ring_buffer_encodes(self):
+        class Source(EventSource):
+            def source_name(self):
+                return "agent"
+
+            def source_id(self):
+                return "agent_0"
+
+        handler = RingBufferEventHandler(1)
+        handler.handle({"name": "offer", "time": 0, "data": Source()})
+        self.assertEqual(handler.events(),
+                         [{"name": "offer", "time": 0, "data": "agent_0"}])
+
+    def test_configured_handlers(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            config = {
+                "event_log": path,
+                "event_sample_rates": {"offer": 2},
+                "event_ring_buffer": 4,
+                "event_reservoir": 2,
+            }
+            handlers = _get_event_handlers(config)
+            self.assertEqual([h.__class__ for h in handlers],
+                             [SamplingEventHandler, RingBufferEventHandler,
+                              ReservoirEventHandler])
+            self.assertEqual(handlers[0].delegate.out_file.name, path)
+            for handler in handlers:
+                handler.close()
+
+            self.assertEqual(_get_event_handlers({"event_log": None}), [])
+        finally:
+            os.remove(path)
+
+    def test_ring_buffer_dump_on_error(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        handler = RingBufferEventHandler(2)
+        try:
+            with self.assertRaises(ValueError):
+                with handler.dump_on_error(path):
+                    for event in self.events("offer", 3):
+                        handler.handle(event)
+                    raise ValueError()
+            with open(path) as f:
+                times = [json.loads(line)["time"] for line in f]
+            self.assertEqual(times, [1, 2])
+        finally:
+            os.remove(path)
+
+    def test_sampling(self):
+        collector = self.Collector()
+        handler = SamplingEventHandler(collector, {"offer": 3})
+        for event in self.events("offer", 7) + self.events("launch", 2):
+            handler.handle(event)
+        samples = [(e["name"], e["time"]) for e in collector.events]
+        self.assertEqual(samples, [("offer", 0), ("offer", 3), ("offer", 6),
+                                   ("launch", 0), ("launch", 1)])
+
+    def test_reservoir(self):
+        handler = ReservoirEventHandler(4, seed=0)
+        for event in self.events("offer", 100) + self.events("launch", 2):
+            handler.handle(event)
+        self.assertEqual(len(handler.reservoirs["offer"]), 4)
+        self.assertEqual(len(handler.reservoirs["launch"]), 2)
+        times = [event["time"] for event in handler.events()]
+        self.assertEqual(times, sorted(times))
+
+
+class TestRotatingEventWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.directory, "events")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def events(self, count):
+        return [{"name": "offer", "time": t} for t in range(count)]
+
+    def test_rotate_by_size(self):
+        writer = RotatingEventWriter(self.prefix, max_bytes=50)
+        for event in self.events(5):
+            writer.handle(event)
+        writer.close()
+
+        # Each event is 29 bytes, so every segment holds two events.
+        segments = sorted(os.listdir(self.directory))
+        self.assertEqual(segments, ["events.00000.gz", "events.00001.gz",
+                                    "events.00002.gz"])
+        self.assertEqual(list(read_events(self.prefix)), self.events(5))
+
+    def test_rotate_by_time(self):
+        writer = RotatingEventWriter(self.prefix, max_time=4, compress=False)
+        for event in self.events(10):
+            writer.handle(event)
+        writer.close()
+
+        segments = sorted(os.listdir(self.directory))
+        self.assertEqual(segments, ["events.00000", "events.00001",
+                                    "events.00002"])
+        self.assertEqual(list(read_events(self.prefix)), self.events(10))
+
+    def test_rerun_replaces_segments(self):
+        writer = RotatingEventWriter(self.prefix, max_bytes=1)
+        for event in self.events(6):
+            writer.handle(event)
+        writer.close()
+
+        rerun = [{"name": "launch", "time": t} for t in range(2)]
+        writer = RotatingEventWriter(self.prefix, max_bytes=1)
+        for event in rerun:
+            writer.handle(event)
+        writer.close()
+
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertEqual(list(read_events(self.prefix)), rerun)
+
+    def test_read_truncated_segment(self):
+        writer = RotatingEventWriter(self.prefix, max_time=50)
+        for event in self.events(100):
+            writer.handle(event)
+        writer.close()
+
+        # Simulate a run killed while writing the final segment.
+        last = self.prefix + ".00001.gz"
+        with open(last, "rb") as f:
+            data = f.read()
+        with open(last, "wb") as f:
+            f.write(data[:len(data) - 20])
+
+        events = list(read_events(self.prefix))
+        self.assertTrue(len(events) >= 50)
+        self.assertTrue(len(events) < 100)
+        self.assertEqual(events, self.events(100)[:len(events)])
+
+    def test_configured_writer(self):
+        config = {
+            "event_log": self.prefix,
+            "event_log_rotate": {"max_time": 2},
+        }
+        handlers = _get_event_handlers(config)
+        self.assertEqual(len(handlers), 1)
+        for event in self.events(3):
+            handlers[0].handle(event)
+        handlers[0].close()
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["events.00000.gz", "events.00001.gz"])
+        self.assertEqual(list(read_events(self.prefix)), self.events(3))
+
+    def test_read_single_file(self):
+        writer = JsonFileEventWriter(self.prefix)
+        for event in self.events(3):
+            writer.handle(event)
+        writer.close()
+        self.assertEqual(list(read_events(self.prefix)), self.events(3))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,23 +1,53 @@
 #!/usr/bin/python
 
-from collections import OrderedDict
+import abc
 
-from event_bus import EventSource, initialize_event_bus, publish_event
+import heapq
+
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+from event_bus import EventSource, initialize_event_bus, publish_event, \
+    register_encoder
 
 import json
 
-import operator
+import random
+
+import time
+
+import unittest
 
 from resource_vector import ResourceVector
 
 
+# Role of frameworks which do not declare one, as in Mesos.
+DEFAULT_ROLE = "*"
+
 global_time = 0
 initialize_event_bus(lambda: global_time)
 
+# Resource vectors are the most common event payload; emit them as flat arrays.
+register_encoder(ResourceVector, lambda resources: resources.vector)
+
 
 class Simulator(EventSource):
-    def __init__(self, allocator):
+    def __init__(self, allocator, progress=None):
+        """
+        :param allocator: The allocator to drive.
+        :type allocator: Allocator
+
+        :param progress: Optional reporter of simulation progress.
+        :type progress: progress.ProgressReporter
+        """
         self.allocator = allocator
+        self.progress = progress
+
+        # Aggregate statistics over all simulated ticks.
+        self.ticks = 0
+        self.allocation_seconds = 0.0
+        self.max_allocation_seconds = 0.0
+        self.utilization = 0.0
 
     def source_name(self):
         return "simulator"
@@ -37,30 +67,179 @@ class Simulator(EventSource):
             for framework in self.allocator.frameworks.itervalues():
                 framework.tick()
 
+            start = time.time()
             self.allocator.tick()
+            elapsed = time.time() - start
+
+            self.ticks += 1
+            self.allocation_seconds += elapsed
+            self.max_allocation_seconds = max(self.max_allocation_seconds,
+                                              elapsed)
+            self.utilization += self.allocator.utilization()
             global_time += 1
 
+            if self.progress is not None:
+                self.progress.update(global_time, self.ticks,
+                                     len(self.allocator.tasks))
+
+    def summary(self):
+        """Returns throughput, utilization and allocation latency statistics
+        for the ticks simulated so far.
+
+        :rtype: dict
+        """
+        ticks = max(self.ticks, 1)
+        return {
+            "ticks": self.ticks,
+            "offers": self.allocator.offers_issued,
+            "tasks_launched": self.allocator.tasks_launched,
+            "tasks_per_tick": float(self.allocator.tasks_launched) / ticks,
+            "mean_utilization": self.utilization / ticks,
+            "mean_allocation_seconds": self.allocation_seconds / ticks,
+            "max_allocation_seconds": self.max_allocation_seconds,
+        }
+
+
+class Task(object):
+    __slots__ = ("framework_name", "task_name", "resources", "duration")
 
-class Task:
     def __init__(self, framework_name, task_name, resources, duration=None):
         self.framework_name = framework_name
         self.task_name = task_name
         self.resources = resources
         self.duration = duration
 
+    def represent(self):
+        return {
+            "framework_name": self.framework_name,
+            "task_name": self.task_name,
+            "resources": self.resources,
+            "duration": self.duration,
+        }
+
+
+class TaskStore:
+    """Compact bookkeeping of running tasks, shared by the allocator and its
+    agents.
+
+    Tasks are stored as parallel lists indexed by an integer slot, with
+    interned framework and agent names. Slots of finished tasks are reused,
+    so memory is bounded by the peak number of concurrently running tasks
+    rather than by the number of tasks ever launched.
+    """
+
+    def __init__(self):
+        # Task fields, indexed by slot
+        self.framework_names = []
+        self.task_names = []
+        self.agent_names = []
+        self.resources = []
+        self.durations = []
+
+        # Slots of removed tasks, available for reuse
+        self.free_slots = []
+
+        # Slot per (framework name, task name)
+        self.slots = {}
+
+        # Slots of all tasks, and of tasks with a duration, per agent
+        self.agent_slots = {}
+        self.timed_slots = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def add(self, agent_name, task):
+        framework_name = _intern(task.framework_name)
+        agent_name = _intern(agent_name)
+
+        key = (framework_name, task.task_name)
+        if key in self.slots:
+            self.remove(self.slots[key])
+
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+            self.framework_names[slot] = framework_name
+            self.task_names[slot] = task.task_name
+            self.agent_names[slot] = agent_name
+            self.resources[slot] = task.resources
+            self.durations[slot] = task.duration
+        else:
+            slot = len(self.framework_names)
+            self.framework_names.append(framework_name)
+            self.task_names.append(task.task_name)
+            self.agent_names.append(agent_name)
+            self.resources.append(task.resources)
+            self.durations.append(task.duration)
+
+        self.slots[key] = slot
+        self.agent_slots.setdefault(agent_name, set()).add(slot)
+        if task.duration is not None:
+            self.timed_slots.setdefault(agent_name, set()).add(slot)
+        return slot
+
+    def remove(self, slot):
+        agent_name = self.agent_names[slot]
+        del self.slots[(self.framework_names[slot], self.task_names[slot])]
+        self.agent_slots[agent_name].discard(slot)
+        self.timed_slots.get(agent_name, set()).discard(slot)
+
+        # Release references held by the slot.
+        self.framework_names[slot] = None
+        self.task_names[slot] = None
+        self.agent_names[slot] = None
+        self.resources[slot] = None
+        self.durations[slot] = None
+        self.free_slots.append(slot)
+
+    def remove_agent(self, agent_name):
+        """Drops the slot indexes of an agent. Its tasks must have been
+        removed already.
+        """
+        self.agent_slots.pop(agent_name, None)
+        self.timed_slots.pop(agent_name, None)
+
+    def find(self, framework_name, task_name):
+        """Returns the slot of the task, or None if it is not running.
+        """
+        return self.slots.get((framework_name, task_name))
+
+    def on_agent(self, agent_name):
+        return self.agent_slots.get(agent_name, set())
+
+    def timed_on_agent(self, agent_name):
+        return self.timed_slots.get(agent_name, set())
+
+
+def _intern(name):
+    if isinstance(name, str):
+        return intern(name)
+    return name
+
 
 class Offer:
-    def __init__(self, agent, resources):
+    def __init__(self, offer_id, agent, framework_name, resources, issued):
+        self.offer_id = offer_id
         self.agent = agent
+        self.framework_name = framework_name
         self.resources = resources
+        self.issued = issued
+
+    def represent(self):
+        return {
+            "offer_id": self.offer_id,
+            "agent_name": self.agent.name,
+            "framework_name": self.framework_name,
+            "resources": self.resources,
+            "issued": self.issued,
+        }
 
 
 class Agent(EventSource):
     def __init__(self, name, resources, allocator):
         self.name = name
-        self.drf = DRFList(resources)
+        self.drf = allocator.policy.create_sorter(resources)
         self.filters = {}
-        self.frameworks = {}
         self.allocator = allocator
 
     def source_name(self):
@@ -69,9 +248,9 @@ class Agent(EventSource):
     def source_id(self):
         return self.name
 
-    def add_framework(self, name):
+    def add_framework(self, name, role=DEFAULT_ROLE, weight=1.0):
         publish_event(self, "add_framework", name)
-        self.drf.add_user(name)
+        self.drf.add_user(name, role, weight)
 
     def add_filter(self, framework_name, duration):
         event_data = { "framework_name": framework_name, "duration": duration }
@@ -85,13 +264,11 @@ class Agent(EventSource):
 
     def launch(self, task):
         publish_event(self, "launch_task", task)
-        if task.framework_name not in self.frameworks:
-            self.frameworks[task.framework_name] = {}
-
-        if task.task_name in self.frameworks[task.framework_name]:
+        tasks = self.allocator.tasks
+        if tasks.find(task.framework_name, task.task_name) is not None:
             print("WARNING: Overriding task %s on agent %s" % (task.task_name, self.name))
 
-        self.frameworks[task.framework_name][task.task_name] = task
+        tasks.add(self.name, task)
 
     def tick(self):
         for framework_name in self.filters.keys():
@@ -103,22 +280,23 @@ class Agent(EventSource):
                 print 'Clearing filter for framework %s' % framework_name
                 del self.filters[framework_name]
 
-        for framework_name in self.frameworks.keys():
-            for task_name in self.frameworks[framework_name].keys():
-                if self.frameworks[framework_name][task_name].duration is None:
-                    # Task never terminates.
-                    continue
-
-                new_duration = self.frameworks[framework_name][task_name].duration - 1
-                self.frameworks[framework_name][task_name].duration = new_duration
+        # Tasks which never terminate are not tracked as timed.
+        tasks = self.allocator.tasks
+        durations = tasks.durations
+        finished = []
+        for slot in tasks.timed_on_agent(self.name):
+            durations[slot] -= 1
+            if durations[slot] <= 0:
+                finished.append(slot)
 
-                if new_duration <= 0:
-                    print('Task %s completed' % task_name)
-                    del self.frameworks[framework_name][task_name]
+        for slot in finished:
+            framework_name = tasks.framework_names[slot]
+            task_name = tasks.task_names[slot]
+            print('Task %s completed' % task_name)
 
-                    update = Update(self.name, framework_name, task_name, "FINISHED")
+            update = Update(self.name, framework_name, task_name, "FINISHED")
 
-                    self.allocator.status_update(update)
+            self.allocator.status_update(update)
 
 
 class Update:
@@ -130,10 +308,45 @@ class Update:
 
 
 class Allocator:
-    def __init__(self):
+    def __init__(self, offer_timeout=None, policy=None):
+        """
+        :param offer_timeout: Number of time-steps after which an outstanding
+                              offer is rescinded, or None to never rescind.
+        :type offer_timeout: int
+
+        :param policy: Allocation policy, defaults to weighted DRF.
+        :type policy: AllocationPolicy
+        """
+        if policy is None:
+            policy = WEIGHTED_DRF_POLICY
+
+        self.policy = policy
         self.agents = {}
         self.frameworks = OrderedDict()
-        self.tasks = {}
+        self.tasks = TaskStore()
+
+        # Resources of the last task launched per framework, used as its
+        # demand when it does not declare one.
+        self.learned_demands = {}
+
+        # Counters for simulation statistics.
+        self.offers_issued = 0
+        self.tasks_launched = 0
+
+        # Role weights and quotas, applied to every agent.
+        self.role_weights = {}
+        self.quotas = {}
+
+        # Outstanding offers by id, plus per-agent and per-framework indexes
+        # of offer ids.
+        self.offers = {}
+        self.agent_offers = {}
+        self.framework_offers = {}
+        self.next_offer_id = 0
+
+        # Offer ids in issue order, for expiry. Only kept with a timeout.
+        self.offer_timeout = offer_timeout
+        self.offer_expiry = deque()
 
     def source_name(self):
         return "allocator"
@@ -144,21 +357,77 @@ class Allocator:
     def add_agent(self, name, resources):
         event_data = { "agent_name": name, "resources": resources }
         publish_event(self, "add_agent", event_data)
-        self.agents[name] = Agent(name, resources, self)
+        agent = Agent(name, resources, self)
+        for role, weight in self.role_weights.iteritems():
+            agent.drf.set_role_weight(role, weight)
+        for role, quota in self.quotas.iteritems():
+            agent.drf.set_quota(role, quota)
+
+        self.agents[name] = agent
+        self.agent_offers[name] = set()
 
     def remove_agent(self, name):
         event_data = { "agent_name": name }
         publish_event(self, "remove_agent", event_data)
-        pass
+        self.reclaim_agent(name)
+
+    def fail_agents(self, names):
+        """Simulates the simultaneous loss of the named agents. All of their
+        tasks are reported LOST and their outstanding offers rescinded.
+        """
+        event_data = { "agent_names": names }
+        publish_event(self, "fail_agents", event_data)
+        for name in names:
+            self.reclaim_agent(name)
+
+    def reclaim_agent(self, name):
+        agent = self.agents[name]
+
+        for offer_id in list(self.agent_offers[name]):
+            self.rescind_offer(offer_id)
+
+        # Only the agent's own task index is visited, so the cost is
+        # proportional to the number of tasks on the agent.
+        for slot in list(self.tasks.on_agent(name)):
+            update = Update(name, self.tasks.framework_names[slot],
+                            self.tasks.task_names[slot], "LOST")
+            self.status_update(update)
+        self.tasks.remove_agent(name)
+
+        del self.agents[name]
+        del self.agent_offers[name]
 
     def add_framework(self, framework):
         publish_event(self, "add_framework", framework.name)
         self.frameworks[framework.name] = framework
+        self.framework_offers[framework.name] = set()
+        role = getattr(framework, "role", DEFAULT_ROLE)
+        weight = getattr(framework, "weight", 1.0)
         for agent_name, agent in self.agents.iteritems():
-            agent.add_framework(framework.name)
+            agent.add_framework(framework.name, role, weight)
+
+    def set_role_weight(self, role, weight):
+        event_data = { "role": role, "weight": weight }
+        publish_event(self, "set_role_weight", event_data)
+        self.role_weights[role] = weight
+        for agent in self.agents.itervalues():
+            agent.drf.set_role_weight(role, weight)
+
+    def set_quota(self, role, resources):
+        """Guarantees a role the supplied resources. As shares are tracked per
+        agent, the quota applies to each agent: frameworks in roles below
+        their quota are offered resources before any other role.
+        """
+        event_data = { "role": role, "resources": resources }
+        publish_event(self, "set_quota", event_data)
+        self.quotas[role] = resources
+        for agent in self.agents.itervalues():
+            agent.drf.set_quota(role, resources)
 
     def allocate(self):
-        for agent_name, agent in self.agents.iteritems():
+        strategy = self.policy.offer_strategy
+        for agent in strategy.agent_order(self, self.agents.values()):
+            agent_name = agent.name
             order = agent.drf.order()
 
             if len(order) == 0:
@@ -176,19 +445,19 @@ class Allocator:
             if out_of_capacity:
                 continue
 
-            # Offer all available resources to first framework.
-            for framework_name, _ in order:
-                print 'Allocator considering framework %s' % framework_name
-                if agent.get_filter(framework_name):
-                    print 'Framework %s is filtered: continue' % framework_name
-                    continue
-
+            # Size all offers up front, as schedulers may launch tasks from
+            # within their offer callbacks. Eligible frameworks are produced
+            # lazily, so strategies serving only the first one stop early.
+            eligible = self.eligible_frameworks(agent, order)
+            sized = strategy.size_offers(self, agent, eligible, resources)
+            for framework_name, resources in sized:
                 agent.drf.allocate(framework_name, resources)
 
                 # Form offer to scheduler
-                offer = Offer(agent, resources)
+                offer = self.issue_offer(agent, framework_name, resources)
 
                 event_data = {
+                    "offer_id": offer.offer_id,
                     "agent_name": agent.name,
                     "framework_name": framework_name,
                     "resources": resources,
@@ -196,8 +465,124 @@ class Allocator:
                 publish_event(self, "resource_offer", event_data)
 
                 self.frameworks[framework_name].offer([offer])
+
+    def eligible_frameworks(self, agent, order):
+        for framework_name, share in order:
+            print 'Allocator considering framework %s' % framework_name
+            if agent.get_filter(framework_name):
+                print 'Framework %s is filtered: continue' % framework_name
+                continue
+            yield framework_name, share
+
+    def issue_offer(self, agent, framework_name, resources):
+        offer = Offer(self.next_offer_id, agent, framework_name, resources,
+                      global_time)
+        self.next_offer_id += 1
+        self.offers_issued += 1
+
+        self.offers[offer.offer_id] = offer
+        self.agent_offers[agent.name].add(offer.offer_id)
+        self.framework_offers[framework_name].add(offer.offer_id)
+        if self.offer_timeout is not None:
+            self.offer_expiry.append(offer.offer_id)
+        return offer
+
+    def remove_offer(self, offer):
+        """Stops tracking an offer. Returns False if the offer was not
+        outstanding, i.e. it was already used, declined or rescinded.
+        """
+        if self.offers.pop(offer.offer_id, None) is None:
+            return False
+
+        self.agent_offers[offer.agent.name].discard(offer.offer_id)
+        self.framework_offers[offer.framework_name].discard(offer.offer_id)
+
+        # Drop leading ids of offers which are no longer outstanding, so the
+        # expiry queue only spans the oldest outstanding offer onwards.
+        while len(self.offer_expiry) > 0 and \
+                self.offer_expiry[0] not in self.offers:
+            self.offer_expiry.popleft()
+        return True
+
+    def demand(self, framework_name):
+        """Returns the resources the framework is expected to ask for next:
+        its declared `demand`, or else the size of its last launched task.
+        Returns None if neither is known.
+        """
+        declared = getattr(self.frameworks[framework_name], "demand", None)
+        if declared is not None:
+            return declared
+        return self.learned_demands.get(framework_name)
+
+    def utilization(self):
+        """Returns the fraction of cluster resources used by running tasks,
+        averaged over resource dimensions.
+        """
+        if len(self.agents) == 0:
+            return 0.0
+
+        total = None
+        used = None
+        for agent in self.agents.itervalues():
+            if total is None:
+                total = agent.drf.total
+                used = agent.drf.consumed
+            else:
+                total = total.add(agent.drf.total)
+                used = used.add(agent.drf.consumed)
+
+        # Outstanding offers are charged to frameworks but not in use.
+        for offer in self.offers.itervalues():
+            used = used.subtract(offer.resources)
+
+        fractions = used.divide(total).vector
+        return sum(fractions) / len(fractions)
+
+    def get_offer(self, offer_id):
+        return self.offers.get(offer_id)
+
+    def offers_for_agent(self, agent_name):
+        return [self.offers[i] for i in self.agent_offers[agent_name]]
+
+    def offers_for_framework(self, framework_name):
+        return [self.offers[i] for i in self.framework_offers[framework_name]]
+
+    def rescind_offer(self, offer_id):
+        offer = self.offers.get(offer_id)
+        if offer is None or not self.remove_offer(offer):
+            return
+
+        event_data = {
+            "offer_id": offer_id,
+            "agent_name": offer.agent.name,
+            "framework_name": offer.framework_name,
+            "resources": offer.resources,
+        }
+        publish_event(self, "rescind_offer", event_data)
+        self.recover(offer.agent.name, offer.resources, offer.framework_name)
+
+        # Rescind notifications are optional for schedulers.
+        framework = self.frameworks[offer.framework_name]
+        if hasattr(framework, "rescind"):
+            framework.rescind(offer)
+
+    def expire_offers(self):
+        if self.offer_timeout is None:
+            return
+
+        # Offers are queued in issue order, so only the head can be expired.
+        # Ids of offers which are no longer outstanding are simply dropped.
+        while len(self.offer_expiry) > 0:
+            offer = self.offers.get(self.offer_expiry[0])
+            if offer is not None and \
+                    offer.issued + self.offer_timeout > global_time:
                 break
 
+            self.offer_expiry.popleft()
+            if offer is not None:
+                print('Rescinding offer %d' % offer.offer_id)
+                self.rescind_offer(offer.offer_id)
+
     def recover(self, agent_name, resources, user_name):
         event_data = {
             "agent_name": agent_name,
@@ -208,27 +593,38 @@ class Allocator:
         self.agents[agent_name].drf.recover(user_name, resources)
 
     def launch(self, task, offer):
+        if offer.offer_id not in self.offers:
+            print("Framework tried to launch task on offer %d which is no "
+                  "longer outstanding" % offer.offer_id)
+            return
+
         for i in range(len(task.resources.vector)):
             if task.resources.vector[i] > offer.resources.vector[i]:
                 print("Framework tried to launch larger task than offer resources")
                 return
 
+        self.remove_offer(offer)
+
         recover = offer.resources.subtract(task.resources)
         self.recover(offer.agent.name, recover, task.framework_name)
 
-        # Schedule task on agent
+        # Schedule task on agent, which records it in the shared task store
+        # to keep track of resources to free up.
         self.agents[offer.agent.name].launch(task)
 
-        # Save reference to task to keep track of resources to free up.
-        if task.framework_name not in self.tasks:
-            self.tasks[task.framework_name] = {}
-
         publish_event(self, "launch_task", task)
 
-        self.tasks[task.framework_name][task.task_name] = task
+        self.learned_demands[task.framework_name] = task.resources
+        self.tasks_launched += 1
 
     def decline(self, framework_name, offer, refuse_steps=5):
+        if not self.remove_offer(offer):
+            print("Framework %s tried to decline offer %d which is no longer "
+                  "outstanding" % (framework_name, offer.offer_id))
+            return
+
         event_data = {
+            "offer_id": offer.offer_id,
             "framework_name": framework_name,
             "agent_name": offer.agent.name,
             "resources": offer.resources,
@@ -249,23 +645,79 @@ class Allocator:
             print 'share:    ' + str(agent.drf.order())
 
     def tick(self):
+        self.expire_offers()
         self.allocate()
 
     def status_update(self, update):
-        task = self.tasks[update.framework_name][update.task_name]
+        slot = self.tasks.find(update.framework_name, update.task_name)
+        resources = self.tasks.resources[slot]
 
-        # Recover resources if terminal. For now, those are the only type of statuses; so recover for now.
-        self.recover(update.agent_name, task.resources, update.framework_name)
+        # Recover resources if terminal. For now, those are the only type of
+        # statuses (FINISHED or LOST); so recover for now.
+        self.recover(update.agent_name, resources, update.framework_name)
 
         # Inform framework about task status.
         self.frameworks[update.framework_name].status_update(update)
 
         # Don't keep track of task any longer as it just completed.
-        del self.tasks[update.framework_name][update.task_name]
+        self.tasks.remove(slot)
+
+
+class Sorter:
+    """Abstract type of per-agent resource accounting and framework ordering.
+    """
+
+    @abc.abstractmethod
+    def available(self):
+        """Returns the unallocated resources of the agent.
+
+        :rtype: ResourceVector
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def order(self):
+        """Returns (framework name, share) pairs in the order in which
+        frameworks should be offered resources.
+
+        :rtype: list of (str, float)
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_user(self, name, role=DEFAULT_ROLE, weight=1.0):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_role_weight(self, role, weight):
+        raise NotImplementedError
 
+    @abc.abstractmethod
+    def set_quota(self, role, resources):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def allocate(self, user, resources):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def recover(self, user, resources):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def allocation(self, user):
+        """Returns the resources currently allocated to the user.
+
+        :rtype: ResourceVector
+        """
+        raise NotImplementedError
+
+
+class DRFList(Sorter):
+    def __init__(self, resources, weighted=True):
+        # Whether user and role weights are honoured
+        self.weighted = weighted
 
-class DRFList:
-    def __init__(self, resources):
         # Available resources
         self.total = resources
 
@@ -278,32 +730,650 @@ class DRFList:
         # Max fair share per user
         self.max_fair_share = {}
 
+        # User weights and roles
+        self.weights = {}
+        self.roles = {}
+
+        # Consumed vector, weight and guaranteed quota per role
+        self.role_consumed = {}
+        self.role_weights = {}
+        self.quotas = {}
+
+        # Sort keys are kept in sorted lists which are updated on every share
+        # change, so order() never has to sort. An update is a bisect search
+        # plus a list insert and delete, which are linear but cheap element
+        # shifts; order() itself is linear as it lists every user. Roles are
+        # ordered by (quota satisfied, weighted share, name) and users within
+        # a role by (weighted share, name).
+        self.role_order = []
+        self.role_keys = {}
+        self.role_users = {}
+        self.user_keys = {}
+
     def available(self):
         return self.total.subtract(self.consumed)
 
     def order(self):
-        return sorted(self.max_fair_share.items(), key=operator.itemgetter(1))
+        result = []
+        for _, _, role in self.role_order:
+            for _, user in self.role_users[role]:
+                result.append((user, self.max_fair_share[user]))
+        return result
 
-    def add_user(self, name):
+    def add_user(self, name, role=DEFAULT_ROLE, weight=1.0):
         self.max_fair_share[name] = 0.0
         self.users[name] = ResourceVector([0] * self.total.dimensions())
+        self.weights[name] = float(weight) if self.weighted else 1.0
+        self.roles[name] = role
+
+        self._add_role(role)
+        self._update_user(name)
+
+    def set_role_weight(self, role, weight):
+        self._add_role(role)
+        if self.weighted:
+            self.role_weights[role] = float(weight)
+            self._update_role(role)
+
+    def set_quota(self, role, resources):
+        self._add_role(role)
+        self.quotas[role] = resources
+        self._update_role(role)
 
     def allocate(self, user, resources):
         # Update consumed vector
         self.consumed = self.consumed.add(resources)
 
-        # Update user vector
+        # Update user and role vectors
         self.users[user] = self.users[user].add(resources)
+        role = self.roles[user]
+        self.role_consumed[role] = self.role_consumed[role].add(resources)
 
-        s = self.users[user].divide(self.total)
-        self.max_fair_share[user] = max(s.vector)
+        self._update_user(user)
+        self._update_role(role)
 
     def recover(self, user, resources):
         # Update consumed vector
         self.consumed = self.consumed.subtract(resources)
 
-        # Update user vector
+        # Update user and role vectors
         self.users[user] = self.users[user].subtract(resources)
+        role = self.roles[user]
+        self.role_consumed[role] = self.role_consumed[role].subtract(resources)
+
+        self._update_user(user)
+        self._update_role(role)
+
+    def allocation(self, user):
+        return self.users[user]
+
+    def _dominant_share(self, resources):
+        return max(resources.divide(self.total).vector)
+
+    def _add_role(self, role):
+        if role in self.role_users:
+            return
+
+        self.role_consumed[role] = ResourceVector([0] * self.total.dimensions())
+        self.role_weights.setdefault(role, 1.0)
+        self.role_users[role] = []
+        self._update_role(role)
+
+    def _update_user(self, user):
+        share = self._dominant_share(self.users[user])
+        self.max_fair_share[user] = share
+
+        key = (share / self.weights[user], user)
+        self._reposition(self.role_users[self.roles[user]], self.user_keys,
+                         user, key)
+
+    def _update_role(self, role):
+        consumed = self.role_consumed[role]
+        quota = self.quotas.get(role)
+        satisfied = quota is None or \
+            all(c >= q for c, q in zip(consumed.vector, quota.vector))
+
+        share = self._dominant_share(consumed) / self.role_weights[role]
+        self._reposition(self.role_order, self.role_keys, role,
+                         (satisfied, share, role))
+
+    def _reposition(self, ordered, keys, name, key):
+        old_key = keys.get(name)
+        if old_key == key:
+            return
+
+        if old_key is not None:
+            del ordered[bisect_left(ordered, old_key)]
+        insort(ordered, key)
+        keys[name] = key
+
+
+class RandomSorter(DRFList):
+    """Sorter which offers resources to frameworks in random order, ignoring
+    shares, roles and quotas. Resource accounting is inherited from DRFList.
+    """
+
+    def __init__(self, resources, seed=None, random_source=None):
+        """
+        :param seed: Seed of the sorter's own random number generator.
+        :type seed: hashable
+
+        :param random_source: Random number generator to use instead, which
+                              may be shared between the sorters of agents
+                              so that they shuffle independently.
+        :type random_source: random.Random
+        """
+        DRFList.__init__(self, resources)
+        if random_source is None:
+            random_source = random.Random(seed)
+        self.random = random_source
+
+    def order(self):
+        result = self.max_fair_share.items()
+        self.random.shuffle(result)
+        return result
+
+
+class OfferStrategy:
+    """Abstract type of offer-sizing strategies.
+    """
+
+    def agent_order(self, allocator, agents):
+        """Returns the agents in the order in which their resources should
+        be offered.
+
+        :type agents: list of Agent
+        :rtype: list of Agent
+        """
+        return agents
+
+    @abc.abstractmethod
+    def size_offers(self, allocator, agent, order, available):
+        """Partitions the available resources of an agent into offers.
+
+        :param order: Unfiltered (framework name, share) pairs, in sorter
+                      order, produced lazily.
+        :type order: iterator of (str, float)
+
+        :param available: Unallocated resources of the agent.
+        :type available: ResourceVector
+
+        :rtype: list of (str, ResourceVector)
+        """
+        raise NotImplementedError
+
+
+class AllAvailableOffers(OfferStrategy):
+    """Offers all available resources of an agent to the first framework in
+    sorter order.
+    """
+
+    def size_offers(self, allocator, agent, order, available):
+        for framework_name, _ in order:
+            return [(framework_name, available)]
+        return []
+
+
+class BestFitOffers(OfferStrategy):
+    """Bin-packing strategy: agents are visited most-utilized first, and each
+    agent is offered to the framework whose demand leaves the least
+    resources over. Frameworks with unknown demand are served in sorter
+    order.
+    """
+
+    def agent_order(self, allocator, agents):
+        return sorted(agents, key=lambda agent: max(
+            agent.drf.available().divide(agent.drf.total).vector))
+
+    def size_offers(self, allocator, agent, order, available):
+        order = list(order)
+        if len(order) == 0:
+            return []
+
+        best = None
+        best_leftover = None
+        for framework_name, _ in order:
+            demand = allocator.demand(framework_name)
+            if demand is None:
+                continue
+
+            leftover = available.subtract(demand)
+            if min(leftover.vector) < 0:
+                continue
+
+            leftover_share = max(leftover.divide(agent.drf.total).vector)
+            if best is None or leftover_share < best_leftover:
+                best = framework_name
+                best_leftover = leftover_share
+
+        if best is None:
+            best = order[0][0]
+        return [(best, available)]
+
+
+class FractionalOffers(OfferStrategy):
+    """Partitions the available resources of an agent among several
+    frameworks in one allocation pass. Frameworks with known demand are
+    handed demand-sized shares by progressive filling: the next share goes
+    to the framework with the lowest weighted dominant share of what it
+    already holds on the agent plus what it was handed so far, ties broken
+    by sorter order, until no further demand fits. Each receives a single offer for its accumulated share. Whatever
+    is left over is offered to the first framework with unknown demand;
+    demands without any positive component count as unknown.
+    """
+
+    def __init__(self, weighted=True):
+        """
+        :param weighted: Whether framework weights scale the shares.
+        :type weighted: bool
+        """
+        self.weighted = weighted
+
+    def size_offers(self, allocator, agent, order, available):
+        total = agent.drf.total
+        candidates = []
+        unknown = []
+        for index, (framework_name, share) in enumerate(order):
+            demand = allocator.demand(framework_name)
+            if demand is None or max(demand.vector) <= 0:
+                unknown.append(framework_name)
+                continue
+
+            weight = 1.0
+            if self.weighted:
+                framework = allocator.frameworks[framework_name]
+                weight = float(getattr(framework, "weight", 1.0))
+            candidates.append((share / weight, index, framework_name, demand,
+                               weight))
+        heapq.heapify(candidates)
+
+        shares = OrderedDict()
+        remaining = available
+        while len(candidates) > 0:
+            _, index, framework_name, demand, weight = \
+                heapq.heappop(candidates)
+            leftover = remaining.subtract(demand)
+            if min(leftover.vector) < 0:
+                # Resources only shrink, so the demand can never fit again.
+                continue
+
+            remaining = leftover
+            if framework_name in shares:
+                shares[framework_name] = shares[framework_name].add(demand)
+            else:
+                shares[framework_name] = demand
+
+            # Every share has a positive component, so each framework's key
+            # grows and the loop ends once the agent is exhausted.
+            held = agent.drf.allocation(framework_name)
+            share = max(held.add(shares[framework_name]).divide(total).vector)
+            share /= weight
+            heapq.heappush(candidates,
+                           (share, index, framework_name, demand, weight))
+
+        result = shares.items()
+        if len(unknown) > 0 and max(remaining.vector) > 0:
+            result.append((unknown[0], remaining))
+        return result
+
+
+class AllocationPolicy:
+    def __init__(self, name, create_sorter, offer_strategy):
+        """
+        :param name: Name of the policy, for reporting.
+        :type name: str
+
+        :param create_sorter: Function creating the sorter of an agent from
+                              its total resources.
+        :type create_sorter: function (ResourceVector) => Sorter
+
+        :param offer_strategy: Strategy used to size offers.
+        :type offer_strategy: OfferStrategy
+        """
+        self.name = name
+        self.create_sorter = create_sorter
+        self.offer_strategy = offer_strategy
+
+
+DRF_POLICY = AllocationPolicy(
+    "drf", lambda resources: DRFList(resources, weighted=False),
+    AllAvailableOffers())
+
+WEIGHTED_DRF_POLICY = AllocationPolicy(
+    "weighted_drf", DRFList, AllAvailableOffers())
+
+# All agents draw from one seeded generator, so runs are reproducible while
+# each agent still shuffles differently.
+_random_policy_source = random.Random(0)
+
+RANDOM_POLICY = AllocationPolicy(
+    "random",
+    lambda resources: RandomSorter(resources,
+                                   random_source=_random_policy_source),
+    AllAvailableOffers())
+
+BEST_FIT_POLICY = AllocationPolicy(
+    "best_fit", DRFList, BestFitOffers())
+
+FRACTIONAL_DRF_POLICY = AllocationPolicy(
+    "fractional_drf", DRFList, FractionalOffers())
+
+
+###############################################################################
+# T E S T S
+###############################################################################
+
+
+class TestScheduler:
+    def __init__(self, name, allocator, job_limit=None, duration=None):
+        self.name = name
+        self.allocator = allocator
+        self.job_limit = job_limit
+        self.duration = duration
+        self.task_count = 0
+        self.offers = []
+        self.rescinded = []
+        self.updates = []
+
+    def offer(self, offers):
+        self.offers.extend(offers)
+        if self.job_limit is None:
+            # Hold on to the offer without responding.
+            return
+
+        for offer in offers:
+            self.task_count += 1
+            task = Task(self.name, str(self.task_count), self.job_limit,
+                        self.duration)
+            self.allocator.launch(task, offer)
+
+    def rescind(self, offer):
+        self.rescinded.append(offer)
+
+    def status_update(self, update):
+        self.updates.append(update)
+
+    def tick(self):
+        pass
+
 
-        s = self.users[user].divide(self.total)
-        self.max_fair_share[user] = max(s.vector)
+class TestAllocator(unittest.TestCase):
+
+    def test_offer_registry(self):
+        allocator = Allocator()
+        allocator.add_agent("agent", ResourceVector([4, 8]))
+        allocator.add_framework(TestScheduler("A", allocator))
+        allocator.allocate()
+
+        offers = allocator.offers_for_framework("A")
+        self.assertEqual(len(offers), 1)
+        self.assertEqual(allocator.offers_for_agent("agent"), offers)
+        self.assertTrue(allocator.get_offer(offers[0].offer_id) is offers[0])
+
+        allocator.decline("A", offers[0])
+        self.assertEqual(allocator.offers_for_framework("A"), [])
+        self.assertEqual(allocator.offers_for_agent("agent"), [])
+        self.assertEqual(allocator.agents["agent"].drf.consumed.vector, [0, 0])
+
+    def test_offer_expiry_bounded(self):
+        for timeout in [None, 5]:
+            allocator = Allocator(offer_timeout=timeout)
+            allocator.add_agent("agent", ResourceVector([4, 8]))
+            allocator.add_framework(
+                TestScheduler("A", allocator, ResourceVector([1, 2]), 1))
+
+            Simulator(allocator).tick(20)
+            self.assertEqual(allocator.offers_issued, 20)
+            self.assertEqual(len(allocator.offers), 0)
+            self.assertEqual(len(allocator.offer_expiry), 0)
+
+    def test_rescind_expired_offers(self):
+        allocator = Allocator(offer_timeout=2)
+        allocator.add_agent("agent", ResourceVector([4, 8]))
+        scheduler = TestScheduler("A", allocator)
+        allocator.add_framework(scheduler)
+
+        simulator = Simulator(allocator)
+        simulator.tick(2)
+        self.assertEqual(len(allocator.offers), 1)
+        self.assertEqual(scheduler.rescinded, [])
+
+        # The expired offer is rescinded and its resources re-offered.
+        simulator.tick(1)
+        self.assertEqual(scheduler.rescinded, scheduler.offers[:1])
+        self.assertEqual(len(scheduler.offers), 2)
+        self.assertEqual(len(allocator.offers), 1)
+        self.assertEqual(allocator.agents["agent"].drf.consumed.vector, [4, 8])
+
+        # Rescinded offers can no longer be used.
+        task = Task("A", "late", ResourceVector([1, 1]))
+        allocator.launch(task, scheduler.rescinded[0])
+        self.assertEqual(len(allocator.tasks), 0)
+
+    def test_remove_agent(self):
+        allocator = Allocator()
+        allocator.add_agent("lost", ResourceVector([4, 4]))
+        allocator.add_agent("kept", ResourceVector([4, 4]))
+        scheduler = TestScheduler("A", allocator, ResourceVector([1, 1]), 10)
+        allocator.add_framework(scheduler)
+        allocator.allocate()
+        allocator.allocate()
+
+        allocator.remove_agent("lost")
+        self.assertEqual(sorted(allocator.agents.keys()), ["kept"])
+        self.assertEqual(len(scheduler.updates), 2)
+        for update in scheduler.updates:
+            self.assertEqual(update.agent_name, "lost")
+            self.assertEqual(update.status, "LOST")
+        self.assertEqual(len(allocator.tasks), 2)
+        self.assertFalse("lost" in allocator.tasks.agent_slots)
+        self.assertFalse("lost" in allocator.tasks.timed_slots)
+
+        allocator.fail_agents(["kept"])
+        self.assertEqual(allocator.agents, {})
+        self.assertEqual(len(allocator.tasks), 0)
+        self.assertEqual(allocator.tasks.agent_slots, {})
+        self.assertEqual(allocator.tasks.timed_slots, {})
+
+    def test_best_fit_policy(self):
+        allocator = Allocator(policy=BEST_FIT_POLICY)
+        allocator.add_agent("agent", ResourceVector([4, 4]))
+        small = TestScheduler("A", allocator)
+        small.demand = ResourceVector([1, 1])
+        large = TestScheduler("B", allocator)
+        large.demand = ResourceVector([4, 4])
+        allocator.add_framework(small)
+        allocator.add_framework(large)
+        allocator.allocate()
+
+        # B is offered the agent despite A having the lower share, as its
+        # demand fits exactly.
+        self.assertEqual(small.offers, [])
+        self.assertEqual(len(large.offers), 1)
+
+    def test_fractional_offers(self):
+        allocator = Allocator(policy=FRACTIONAL_DRF_POLICY)
+        allocator.add_agent("agent", ResourceVector([6, 6]))
+        small = TestScheduler("A", allocator)
+        small.demand = ResourceVector([2, 2])
+        large = TestScheduler("B", allocator)
+        large.demand = ResourceVector([3, 3])
+        unknown = TestScheduler("C", allocator)
+        allocator.add_framework(small)
+        allocator.add_framework(large)
+        allocator.add_framework(unknown)
+        allocator.allocate()
+
+        self.assertEqual(small.offers[0].resources.vector, [2, 2])
+        self.assertEqual(large.offers[0].resources.vector, [3, 3])
+        self.assertEqual(unknown.offers[0].resources.vector, [1, 1])
+        self.assertEqual(allocator.agents["agent"].drf.available().vector,
+                         [0, 0])
+
+    def test_fractional_offers_weighted(self):
+        allocator = Allocator(policy=FRACTIONAL_DRF_POLICY)
+        allocator.add_agent("agent", ResourceVector([9, 9]))
+        heavy = TestScheduler("A", allocator)
+        heavy.demand = ResourceVector([1, 1])
+        heavy.weight = 2
+        light = TestScheduler("B", allocator)
+        light.demand = ResourceVector([1, 1])
+        allocator.add_framework(heavy)
+        allocator.add_framework(light)
+        allocator.allocate()
+
+        self.assertEqual(heavy.offers[0].resources.vector, [6, 6])
+        self.assertEqual(light.offers[0].resources.vector, [3, 3])
+
+    def test_fractional_offers_existing_allocation(self):
+        allocator = Allocator(policy=FRACTIONAL_DRF_POLICY)
+        allocator.add_agent("agent", ResourceVector([10, 10]))
+        holder = TestScheduler("A", allocator)
+        holder.demand = ResourceVector([1, 1])
+        starved = TestScheduler("B", allocator)
+        starved.demand = ResourceVector([1, 1])
+        allocator.add_framework(holder)
+        allocator.add_framework(starved)
+        allocator.agents["agent"].drf.allocate("A", ResourceVector([6, 6]))
+        allocator.allocate()
+
+        # B stays below A's share of 0.6 while taking all free resources.
+        self.assertEqual(holder.offers, [])
+        self.assertEqual(starved.offers[0].resources.vector, [4, 4])
+
+    def test_fractional_offers_zero_demand(self):
+        allocator = Allocator(policy=FRACTIONAL_DRF_POLICY)
+        allocator.add_agent("agent", ResourceVector([4, 4]))
+        empty = TestScheduler("A", allocator)
+        empty.demand = ResourceVector([0, 0])
+        sized = TestScheduler("B", allocator)
+        sized.demand = ResourceVector([1, 1])
+        allocator.add_framework(empty)
+        allocator.add_framework(sized)
+        allocator.allocate()
+
+        # The zero demand is treated as unknown rather than fitting forever.
+        self.assertEqual(sized.offers[0].resources.vector, [4, 4])
+        self.assertEqual(empty.offers, [])
+
+    def test_progress(self):
+        class Progress:
+            def __init__(self):
+                self.updates = []
+
+            def update(self, sim_time, ticks, active_tasks):
+                self.updates.append((ticks, active_tasks))
+
+        allocator = Allocator()
+        allocator.add_agent("agent", ResourceVector([4, 8]))
+        allocator.add_framework(
+            TestScheduler("A", allocator, ResourceVector([1, 2])))
+
+        progress = Progress()
+        simulator = Simulator(allocator, progress)
+        simulator.tick(2)
+        self.assertEqual(progress.updates, [(1, 1), (2, 2)])
+
+    def test_summary(self):
+        allocator = Allocator()
+        allocator.add_agent("agent", ResourceVector([4, 8]))
+        allocator.add_framework(
+            TestScheduler("A", allocator, ResourceVector([1, 2]), 1))
+
+        simulator = Simulator(allocator)
+        simulator.tick(4)
+        summary = simulator.summary()
+        self.assertEqual(summary["ticks"], 4)
+        self.assertEqual(summary["tasks_launched"], 4)
+        self.assertEqual(summary["mean_utilization"], 0.25)
+
+
+class TestTaskStore(unittest.TestCase):
+
+    def test_slot_reuse(self):
+        store = TaskStore()
+        first = store.add("agent", Task("A", "1", ResourceVector([1, 1]), 2))
+        second = store.add("agent", Task("A", "2", ResourceVector([1, 1])))
+        self.assertEqual(store.find("A", "1"), first)
+        self.assertEqual(store.on_agent("agent"), set([first, second]))
+        self.assertEqual(store.timed_on_agent("agent"), set([first]))
+
+        store.remove(first)
+        self.assertEqual(store.find("A", "1"), None)
+        self.assertEqual(store.on_agent("agent"), set([second]))
+
+        third = store.add("other", Task("B", "1", ResourceVector([2, 2])))
+        self.assertEqual(third, first)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(len(store.framework_names), 2)
+        self.assertEqual(store.resources[third].vector, [2, 2])
+
+
+class TestDRFList(unittest.TestCase):
+
+    def test_order(self):
+        drf = DRFList(ResourceVector([10, 10]))
+        drf.add_user("A")
+        drf.add_user("B")
+        drf.allocate("A", ResourceVector([2, 1]))
+        drf.allocate("B", ResourceVector([1, 3]))
+        self.assertEqual(drf.order(), [("A", 0.2), ("B", 0.3)])
+
+        drf.recover("B", ResourceVector([1, 3]))
+        self.assertEqual(drf.order(), [("B", 0.0), ("A", 0.2)])
+
+    def test_weights(self):
+        drf = DRFList(ResourceVector([10, 10]))
+        drf.add_user("A", weight=2)
+        drf.add_user("B")
+        drf.allocate("A", ResourceVector([3, 3]))
+        drf.allocate("B", ResourceVector([2, 2]))
+        self.assertEqual(drf.order(), [("A", 0.3), ("B", 0.2)])
+
+    def test_roles(self):
+        drf = DRFList(ResourceVector([10, 10]))
+        drf.add_user("A", "dev")
+        drf.add_user("B", "dev")
+        drf.add_user("C", "prod")
+        drf.allocate("A", ResourceVector([1, 1]))
+        drf.allocate("B", ResourceVector([2, 2]))
+        drf.allocate("C", ResourceVector([4, 4]))
+
+        # Role shares are compared first, then user shares within the role.
+        self.assertEqual(drf.order(), [("A", 0.1), ("B", 0.2), ("C", 0.4)])
+
+        drf.set_role_weight("prod", 4)
+        self.assertEqual(drf.order(), [("C", 0.4), ("A", 0.1), ("B", 0.2)])
+
+    def test_random_policy_agents_differ(self):
+        sorters = [RANDOM_POLICY.create_sorter(ResourceVector([10, 10]))
+                   for _ in range(2)]
+        for sorter in sorters:
+            for name in "ABCDEF":
+                sorter.add_user(name)
+
+        orders = [(sorters[0].order(), sorters[1].order()) for _ in range(5)]
+        self.assertTrue(any(first != second for first, second in orders))
+
+    def test_unweighted(self):
+        drf = DRFList(ResourceVector([10, 10]), weighted=False)
+        drf.add_user("A", weight=2)
+        drf.add_user("B")
+        drf.allocate("A", ResourceVector([3, 3]))
+        drf.allocate("B", ResourceVector([2, 2]))
+        self.assertEqual(drf.order(), [("B", 0.2), ("A", 0.3)])
+
+    def test_quota(self):
+        drf = DRFList(ResourceVector([10, 10]))
+        drf.add_user("A", "dev")
+        drf.add_user("B", "prod")
+        drf.set_quota("prod", ResourceVector([5, 5]))
+        drf.allocate("B", ResourceVector([4, 4]))
+        self.assertEqual(drf.order(), [("B", 0.4), ("A", 0.0)])
+
+        drf.allocate("B", ResourceVector([1, 1]))
+        self.assertEqual(drf.order(), [("A", 0.0), ("B", 0.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+from resource_vector import ResourceVector
+from mesos_allocator import Allocator, Simulator, Task, BEST_FIT_POLICY, \
+    DRF_POLICY, FRACTIONAL_DRF_POLICY, RANDOM_POLICY, WEIGHTED_DRF_POLICY
+
+
+class GreedyScheduler:
+    def __init__(self, name, allocator, job_limit, duration, weight=1.0):
+        self.name = name
+        self.allocator = allocator
+        self.job_limit = job_limit
+        self.duration = duration
+        self.weight = weight
+        self.demand = job_limit
+        self.task_count = 0
+
+    def offer(self, offers):
+        for offer in offers:
+            if min(offer.resources.subtract(self.job_limit).vector) < 0:
+                self.allocator.decline(self.name, offer, 1)
+                continue
+
+            # Generate task id. Should be unique for framework.
+            self.task_count += 1
+
+            task = Task(self.name, str(self.task_count), self.job_limit,
+                        self.duration)
+            self.allocator.launch(task, offer)
+
+    def status_update(self, status):
+        pass
+
+    def tick(self):
+        pass
+
+
+def run(policy, ticks):
+    allocator = Allocator(policy=policy)
+
+    allocator.add_agent('small', ResourceVector([4, 8]))
+    allocator.add_agent('medium', ResourceVector([8, 16]))
+    allocator.add_agent('large', ResourceVector([16, 32]))
+
+    allocator.add_framework(
+        GreedyScheduler('A', allocator, ResourceVector([1, 4]), 3))
+    allocator.add_framework(
+        GreedyScheduler('B', allocator, ResourceVector([3, 1]), 5, 2.0))
+    allocator.add_framework(
+        GreedyScheduler('C', allocator, ResourceVector([6, 12]), 8))
+
+    simulator = Simulator(allocator)
+    simulator.tick(ticks)
+    return simulator.summary()
+
+
+def main():
+    ticks = 50
+    policies = [DRF_POLICY, WEIGHTED_DRF_POLICY, RANDOM_POLICY,
+                BEST_FIT_POLICY, FRACTIONAL_DRF_POLICY]
+    results = [(policy.name, run(policy, ticks)) for policy in policies]
+
+    print('%-14s %8s %10s %12s %14s' % ('policy', 'tasks', 'tasks/tick',
+                                        'utilization', 'alloc ms/tick'))
+    for name, summary in results:
+        print('%-14s %8d %10.2f %12.3f %14.3f' % (
+            name, summary['tasks_launched'], summary['tasks_per_tick'],
+            summary['mean_utilization'],
+            summary['mean_allocation_seconds'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
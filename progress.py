@@ -0,0 +1,182 @@
+import BaseHTTPServer
+import json
+import resource
+import sys
+import threading
+import time
+import unittest
+import urllib2
+
+from event_bus import EventBus, EventSource, get_event_bus
+
+
+class ProgressReporter:
+    """Periodically reports simulation progress and throughput.
+
+    The simulator calls `update` once per tick; a report is only formed and
+    printed once the reporting interval of wall time has passed, so the
+    per-tick cost is a single clock read.
+    """
+
+    def __init__(self, interval=5.0, out=sys.stdout, event_bus=None):
+        """
+        :param interval: Wall time between reports, in seconds.
+        :type interval: float
+
+        :param out: Stream to print reports to, or None to only keep the
+                    latest report (for example for a `StatusServer`).
+        :type out: file
+
+        :param event_bus: Event bus whose events are counted, defaults to the
+                          global event bus.
+        :type event_bus: EventBus
+        """
+
+        if event_bus is None:
+            event_bus = get_event_bus()
+
+        self.interval = interval
+        self.out = out
+        self.event_bus = event_bus
+
+        self.start_time = time.time()
+        self.last_time = self.start_time
+        self.last_ticks = 0
+        self.last_events = event_bus.published
+        self.latest = None
+
+    def update(self, sim_time, ticks, active_tasks):
+        """Records the progress of the simulation, reporting it if the
+        interval has passed.
+
+        :param sim_time: Current simulation time-step.
+        :type sim_time: int
+
+        :param ticks: Number of ticks simulated so far.
+        :type ticks: int
+
+        :param active_tasks: Number of currently running tasks.
+        :type active_tasks: int
+        """
+
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed < self.interval:
+            return
+
+        events = self.event_bus.published
+        rate = lambda count: count / elapsed if elapsed > 0 else 0.0
+        self.latest = {
+            "sim_time": sim_time,
+            "wall_seconds": now - self.start_time,
+            "ticks": ticks,
+            "ticks_per_second": rate(ticks - self.last_ticks),
+            "events_per_second": rate(events - self.last_events),
+            "active_tasks": active_tasks,
+            # Peak resident set size, in kilobytes on Linux.
+            "max_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+        self.last_time = now
+        self.last_ticks = ticks
+        self.last_events = events
+
+        if self.out is not None:
+            self.out.write("[progress] sim time %(sim_time)d, "
+                           "wall %(wall_seconds).1fs, "
+                           "%(ticks_per_second).1f ticks/s, "
+                           "%(events_per_second).1f events/s, "
+                           "%(active_tasks)d active tasks, "
+                           "max rss %(max_rss)d KB\n" % self.latest)
+            self.out.flush()
+
+
+class StatusServer:
+    """Serves the latest report of a `ProgressReporter` as JSON over HTTP
+    from a background thread.
+    """
+
+    def __init__(self, reporter, port=0, host="127.0.0.1"):
+        """
+        :param reporter: Reporter whose latest report is served.
+        :type reporter: ProgressReporter
+
+        :param port: Port to listen on; 0 picks a free port.
+        :type port: int
+
+        :param host: Address to bind to.
+        :type host: str
+        """
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(reporter.latest)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = BaseHTTPServer.HTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+###############################################################################
+# T E S T S
+###############################################################################
+
+
+class TestProgress(unittest.TestCase):
+
+    class Source(EventSource):
+        def source_name(self):
+            return "test_source_name"
+
+        def source_id(self):
+            return "test_source_id"
+
+    def setUp(self):
+        self.event_bus = EventBus([], lambda: 0)
+
+    def test_interval(self):
+        reporter = ProgressReporter(3600, None, self.event_bus)
+        reporter.update(1, 1, 0)
+        self.assertEqual(reporter.latest, None)
+
+    def test_report(self):
+        reporter = ProgressReporter(0, None, self.event_bus)
+        self.event_bus.publish(self.Source(), "test_event")
+        reporter.update(5, 5, 2)
+        self.assertEqual(reporter.latest["sim_time"], 5)
+        self.assertEqual(reporter.latest["active_tasks"], 2)
+        self.assertTrue(reporter.latest["events_per_second"] > 0)
+
+    def test_status_server(self):
+        reporter = ProgressReporter(0, None, self.event_bus)
+        reporter.update(7, 7, 3)
+        server = StatusServer(reporter).start()
+        try:
+            url = "http://127.0.0.1:%d/" % server.port
+            status = json.load(urllib2.urlopen(url))
+        finally:
+            server.stop()
+        self.assertEqual(status["sim_time"], 7)
+        self.assertEqual(status["active_tasks"], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()